@@ -8,9 +8,226 @@ Provides the ConwayBase class and an implementation of said class.
 """
 
 from abc import ABC, abstractclassmethod
+import ctypes
+import os
+import subprocess
+import tempfile
+import warnings
 
 
 import numpy as np
+try:
+    from numba import njit, prange
+    _HAS_NUMBA = True
+except ImportError:
+    # numba is optional, without it the kernels run as plain python.
+    _HAS_NUMBA = False
+    prange = range
+
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda func: func
+try:
+    from conway_kernel import update_padded as _update_cython
+except ImportError:
+    # the Cython kernel is optional, see setup.py
+    _update_cython = None
+
+
+def _pack_field(field: np.ndarray) -> np.ndarray:
+    """
+    Packs the cells of a 2D 0/1 field into uint64 words, 64 cells per word.
+    Bit k of word w in a row holds the cell in column 64 * w + k, unused bits
+    of the last word are zero.
+    """
+    packed = np.packbits(np.asarray(field, dtype=bool), axis=1, bitorder='little')
+    words = -(-packed.shape[1] // 8)
+    packed = np.pad(packed, ((0, 0), (0, 8 * words - packed.shape[1])))
+    return np.ascontiguousarray(packed).view('<u8').astype(np.uint64)
+
+
+def _unpack_field(packed: np.ndarray, width: int) -> np.ndarray:
+    """
+    Inverse of _pack_field, returns a uint8 field with the given width.
+    """
+    packed = np.ascontiguousarray(packed.astype('<u8')).view(np.uint8)
+    return np.unpackbits(packed, axis=1, count=width, bitorder='little')
+
+
+def _step_packed(packed: np.ndarray) -> np.ndarray:
+    """
+    Calculates the next generation of a packed field. The 8 neighbors of all
+    64 cells of a word are added up bitwise with full adders, which leaves the
+    neighbor count as 4 bit planes b0..b3. Cells outside the field are dead.
+    """
+    one, msb = np.uint64(1), np.uint64(63)
+    # carry the bits crossing word borders into the neighboring word
+    from_prev = np.zeros_like(packed)
+    from_prev[:, 1:] = packed[:, :-1] >> msb
+    from_next = np.zeros_like(packed)
+    from_next[:, :-1] = packed[:, 1:] << msb
+    left = (packed << one) | from_prev
+    right = (packed >> one) | from_next
+    # horizontal sums: 3 cells for the rows above and below, 2 for the own row
+    row_sum = left ^ packed ^ right
+    row_carry = (left & packed) | ((left ^ packed) & right)
+    own_sum = left ^ right
+    own_carry = left & right
+    up_sum, up_carry = np.zeros_like(packed), np.zeros_like(packed)
+    up_sum[1:], up_carry[1:] = row_sum[:-1], row_carry[:-1]
+    down_sum, down_carry = np.zeros_like(packed), np.zeros_like(packed)
+    down_sum[:-1], down_carry[:-1] = row_sum[1:], row_carry[1:]
+    # vertical sums of the three 2 bit numbers
+    b0 = up_sum ^ own_sum ^ down_sum
+    carry0 = (up_sum & own_sum) | ((up_sum ^ own_sum) & down_sum)
+    twos = up_carry ^ own_carry ^ down_carry
+    fours = (up_carry & own_carry) | ((up_carry ^ own_carry) & down_carry)
+    b1 = twos ^ carry0
+    carry1 = twos & carry0
+    b2 = fours ^ carry1
+    b3 = fours & carry1
+    # born with 3, survive with 2 or 3 neighbors
+    return ~b3 & ~b2 & b1 & (b0 | packed)
+
+
+@njit(cache=True, boundscheck=False)
+def _row_words(packed, row, word):
+    """
+    Returns the word of a packed row together with the words of its left and
+    right neighbors shifted onto the same bits. Rows outside the field are 0.
+    """
+    zero, one, msb = np.uint64(0), np.uint64(1), np.uint64(63)
+    if row < 0 or row >= packed.shape[0]:
+        return zero, zero, zero
+    center = packed[row, word]
+    left = center << one
+    right = center >> one
+    if word > 0:
+        left |= packed[row, word - 1] >> msb
+    if word < packed.shape[1] - 1:
+        right |= packed[row, word + 1] << msb
+    return left, center, right
+
+
+@njit(parallel=True, cache=True, boundscheck=False)
+def _step_packed_words(packed, out):
+    """
+    Same as _step_packed, but word by word and compiled by numba, so no
+    temporary arrays are needed. Writes the next generation into out.
+    """
+    for row in prange(packed.shape[0]):
+        for word in range(packed.shape[1]):
+            up_left, up, up_right = _row_words(packed, row - 1, word)
+            left, center, right = _row_words(packed, row, word)
+            down_left, down, down_right = _row_words(packed, row + 1, word)
+            # horizontal sums: 3 cells for the rows above and below, 2 for the own row
+            up_sum = up_left ^ up ^ up_right
+            up_carry = (up_left & up) | ((up_left ^ up) & up_right)
+            own_sum = left ^ right
+            own_carry = left & right
+            down_sum = down_left ^ down ^ down_right
+            down_carry = (down_left & down) | ((down_left ^ down) & down_right)
+            # vertical sums of the three 2 bit numbers
+            b0 = up_sum ^ own_sum ^ down_sum
+            carry0 = (up_sum & own_sum) | ((up_sum ^ own_sum) & down_sum)
+            twos = up_carry ^ own_carry ^ down_carry
+            fours = (up_carry & own_carry) | ((up_carry ^ own_carry) & down_carry)
+            b1 = twos ^ carry0
+            carry1 = twos & carry0
+            b2 = fours ^ carry1
+            b3 = fours & carry1
+            # born with 3, survive with 2 or 3 neighbors
+            out[row, word] = ~b3 & ~b2 & b1 & (b0 | center)
+
+
+@njit(parallel=True, cache=True, boundscheck=False)
+def _update_slow(current_field, new_field):
+    """
+    Explicit loop over all cells, writes the next generation of current_field
+    into new_field. Compiled by numba when it is installed.
+    """
+    shape = current_field.shape
+    for col in prange(shape[0]):
+        for row in range(shape[1]):
+            # calculate living neighbors
+            living_neighbors = 0
+            for i in range(-1, 2):
+                for j in range(-1, 2):
+                    if (not (i == 0 and j == 0)) and 0 <= col+i < shape[0] and 0 <= row+j < shape[1]:
+                        # ignore the field itself and don't try to read out of bounds.
+                        living_neighbors += int(current_field[col+i, row+j])
+            # calculate
+            if current_field[col, row]:
+                # living
+                if living_neighbors < 2 or living_neighbors > 3:
+                    new_field[col, row] = 0
+                else:
+                    new_field[col, row] = current_field[col, row]
+            else:
+                # dead
+                if living_neighbors == 3:
+                    new_field[col, row] = 1
+                else:
+                    new_field[col, row] = current_field[col, row]
+
+
+# C version of the update step with the padded shape fixed at compile time,
+# so the compiler knows all loop bounds.
+_C_KERNEL = """
+#define ROWS {rows}
+#define COLS {cols}
+
+void update(const unsigned char *restrict pad, unsigned char *restrict new)
+{{
+    for (int col = 1; col < ROWS - 1; col++) {{
+        const unsigned char *up = pad + (col - 1) * COLS;
+        const unsigned char *mid = up + COLS;
+        const unsigned char *down = mid + COLS;
+        unsigned char *out = new + col * COLS;
+        for (int row = 1; row < COLS - 1; row++) {{
+            int n = up[row - 1] + up[row] + up[row + 1]
+                  + mid[row - 1] + mid[row + 1]
+                  + down[row - 1] + down[row] + down[row + 1];
+            /* born with 3, survive with 2 or 3 neighbors */
+            out[row] = (n == 3) | ((n == 2) & (mid[row] != 0));
+        }}
+    }}
+}}
+"""
+_compiled_kernels = {}
+
+
+def _compile_kernel(shape: tuple):
+    """
+    Compiles _C_KERNEL for a padded field of the given shape with the C
+    compiler from $CC (default cc) and returns the loaded function. Results
+    are cached per shape. Returns None and warns, if the kernel could not be
+    built.
+    """
+    if shape not in _compiled_kernels:
+        kernel = None
+        with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as tmp:
+            source = os.path.join(tmp, 'conway_kernel.c')
+            library = os.path.join(tmp, 'conway_kernel.so')
+            with open(source, 'w') as file:
+                file.write(_C_KERNEL.format(rows=shape[0], cols=shape[1]))
+            compiler = os.environ.get('CC', 'cc')
+            try:
+                subprocess.run([compiler, '-O3', '-march=native', '-funroll-loops', '-shared', '-fPIC',
+                                '-o', library, source], check=True, capture_output=True)
+                kernel = ctypes.CDLL(library).update
+            except subprocess.CalledProcessError as error:
+                warnings.warn(f"compiling the C kernel with {compiler!r} failed, "
+                              f"falling back to update_field_slow:\n{error.stderr.decode(errors='replace')}", stacklevel=3)
+            except OSError as error:
+                warnings.warn(f"building the C kernel with {compiler!r} failed, "
+                              f"falling back to update_field_slow: {error}", stacklevel=3)
+            else:
+                kernel.argtypes = [ctypes.c_void_p, ctypes.c_void_p]
+                kernel.restype = None
+        _compiled_kernels[shape] = kernel
+    return _compiled_kernels[shape]
 
 
 class ConwayBase(ABC):
@@ -30,14 +247,18 @@ class ConwayBase(ABC):
     start_field: numpy.ndarray
         Simulation field at the start of the Game.
     current_field: numpy.ndarray
-        Current state of the Simulation field.
+        Current state of the Simulation field, one uint8 per cell.
     size: int
         Size of the start_field numpy.ndarray
     shape: (int, int)
         Shape of the start_field numpy.ndarray
     is_empty: bool
         Checks whether there are any points left on the simulation field.
+    xp: module
+        Array module holding the fields, numpy unless a subclass changes it.
     """
+    xp = np
+
     def __init__(self, start_field: np.ndarray):
         self.start_field = start_field
         self.reset_field()
@@ -69,63 +290,146 @@ class ConwayBase(ABC):
     
     def reset_field(self):
         """
-        Resets the simulation field to the starting configuration.
+        Resets the simulation field to the starting configuration. The
+        values are copied into the existing current_field, if there is one.
+        Every non-zero value of start_field becomes a living cell (1).
         """
-        self.current_field = np.array(self.start_field, copy=True)
+        if not hasattr(self, 'current_field'):
+            self.current_field = self.xp.empty(np.shape(self.start_field), dtype=self.xp.uint8)
+        self.xp.not_equal(self.xp.asarray(self.start_field), 0, out=self.current_field)
     
     @property
     def is_empty(self) -> bool:
         """
         Checks and returns, if current_field has no non-zero values.
         """
-        return np.sum(self.current_field) == 0
+        return not self.current_field.any()
 
 
 class Conway(ConwayBase):
+    """
+    Conway's Game of Life, see ConwayBase.
+
+    Parameters
+    ----------
+    start_field : numpy.ndarray
+        Simulation field at the start of the Game.
+    backend : str, optional
+        'numpy' or 'cupy'. With 'cupy' the fields are stored on the GPU and
+        update_field runs there, the other update_field_* methods need the
+        'numpy' backend. The default is 'numpy'.
+    """
     def __init__(self, start_field, border:bool = True,
-                 fade: tuple = (1, 1, 1), gauss_sigma: tuple = (0, 0, 0)):
+                 fade: tuple = (1, 1, 1), gauss_sigma: tuple = (0, 0, 0),
+                 backend: str = 'numpy'):
+        if backend == 'cupy':
+            import cupy
+            self.xp = cupy
+        elif backend != 'numpy':
+            raise ValueError(f"unknown backend {backend!r}, use 'numpy' or 'cupy'")
+        xp = self.xp
+        # the fields are stored with a border of dead cells around them and
+        # current_field is a view onto the inner part. The next generation
+        # is written into the second buffer, then both are swapped.
+        (width, height) = np.shape(start_field)
+        self._padded = xp.zeros((width + 2, height + 2), dtype=xp.uint8)
+        self._next_padded = xp.zeros_like(self._padded)
+        self.current_field = self._padded[1:-1, 1:-1]
+        self._next_field = self._next_padded[1:-1, 1:-1]
         super().__init__(start_field)
-        self.current_view = np.zeros_like(self.current_field)
-        self.mask = np.zeros_like(self.current_view)
-        self.mask[1:-1,1:-1] = 1
+        if xp is np:
+            self.current_view = xp.zeros(self.shape)
+        else:
+            # half precision is enough for the fading view on the GPU
+            self.current_view = xp.zeros(self.shape, dtype=xp.float16)
+        self.color = np.uint32(0xFF0000)
+        # show_field returns this buffer, it is overwritten every frame. On the
+        # GPU the image is copied into a second buffer in host memory.
+        self._image = xp.empty(self.shape, dtype=xp.uint32)
+        if xp is not np:
+            self._host_image = np.empty(self.shape, dtype=np.uint32)
+        # scratch buffers of update_field_fast, reused every tick
+        self._column_sums = xp.empty((self.shape[0], self.shape[1] + 2), dtype=xp.uint8)
+        self._neighbors = xp.empty(self.shape, dtype=xp.uint8)
         pass
     
     def update_field_slow(self):
-        shape = self.current_field.shape
-        new_field = np.array(self.current_field)
-        for (col, row) in np.ndindex(shape):
-            # calculate living neighbors
-            living_neighbors = 0
-            for i in range(-1, 2):
-                for j in range(-1, 2):
-                    if (not (i == 0 and j == 0)) and 0 <= col+i < shape[0] and 0 <= row+j < shape[1]:
-                        # ignore the field itself and don't try to read out of bounds.
-                        living_neighbors += self.current_field[col+i, row+j]
-            # calculate
-            if self.current_field[col, row]:
-                # living
-                if living_neighbors < 2 or living_neighbors > 3:
-                    new_field[col, row] = 0
-            else:
-                # dead
-                if living_neighbors == 3:
-                    new_field[col, row] = 1
-        self.current_field = new_field
+        _update_slow(self.current_field, self._next_field)
+        self._swap_fields()
+
+    def update_field_cython(self):
+        # same rules and borders as update_field_slow, falls back to it when
+        # the conway_kernel extension is not built.
+        if _update_cython is None:
+            return self.update_field_slow()
+        _update_cython(self._padded, self._next_padded)
+        self._swap_fields()
+
+    def update_field_native(self):
+        # same as update_field_cython, but the C kernel is generated and
+        # compiled for this shape on the first call. Falls back to
+        # update_field_slow without a C compiler.
+        if not hasattr(self, '_native_kernel'):
+            self._native_kernel = _compile_kernel(self._padded.shape)
+        if self._native_kernel is None:
+            return self.update_field_slow()
+        self._native_kernel(self._padded.ctypes.data, self._next_padded.ctypes.data)
+        self._swap_fields()
+
+    def update_field_convolve(self):
+        # same rules and borders as update_field_slow, but the neighbor sum
+        # is done by a single convolution. scipy is only needed here.
+        from scipy.signal import convolve2d
+        kernel = np.ones((3, 3), dtype=np.int8)
+        living_neighbors = convolve2d(self.current_field, kernel, mode='same', boundary='fill') - self.current_field
+        np.logical_or(living_neighbors == 3, (living_neighbors == 2) & self.current_field.view(bool), out=self._next_field)
+        self._swap_fields()
+
+    def update_field_packed(self):
+        # same rules and borders as update_field_slow, calculated on 64 cells
+        # at once in the bit packed representation.
+        packed = _pack_field(self.current_field)
+        if _HAS_NUMBA:
+            new_packed = np.empty_like(packed)
+            _step_packed_words(packed, new_packed)
+            packed = new_packed
+        else:
+            packed = _step_packed(packed)
+        self._next_field[...] = _unpack_field(packed, self.shape[1])
+        self._swap_fields()
 
     def update_field_fast(self):
-        rolling = [(0, 1), (1, 1), (1, 0), (1, -1), (-1, 1), (-1, 0), (-1, -1), (0, -1)]
-        roll_arr = [np.roll(np.roll(self.current_field, roll[0], axis=0), roll[1], axis=1) for roll in rolling]
-        living_neighbors = sum(roll_arr)
-        deading = np.logical_and(self.current_field, np.logical_or(living_neighbors < 2, living_neighbors > 3))
-        living = np.logical_and(np.logical_not(self.current_field), living_neighbors == 3)
-        self.current_field[deading] = 0
-        self.current_field[living] = 1
-        self.current_field[self.mask == 0] = 0
+        # add up the shifted views of the zero padded field, first the 3 cells
+        # above each other, then 3 of those sums next to each other.
+        xp = self.xp
+        pad = self._padded
+        column_sums = self._column_sums
+        living_neighbors = self._neighbors
+        xp.add(pad[:-2], pad[1:-1], out=column_sums)
+        column_sums += pad[2:]
+        xp.add(column_sums[:, :-2], column_sums[:, 1:-1], out=living_neighbors)
+        living_neighbors += column_sums[:, 2:]
+        living_neighbors -= self.current_field
+        # born with 3, survive with 2 or 3 neighbors
+        xp.logical_or(living_neighbors == 3, (living_neighbors == 2) & self.current_field.view(bool), out=self._next_field)
+        self._swap_fields()
+
+    def _swap_fields(self):
+        self._padded, self._next_padded = self._next_padded, self._padded
+        self.current_field, self._next_field = self._next_field, self.current_field
 
     def update_field(self):
         #self.update_field_slow()
         self.update_field_fast()
 
     def show_field(self) -> np.ndarray:
-        self.current_view = 0.05 * self.current_view + 1 * self.current_field
-        return np.array(0xFF0000 * self.current_view)
\ No newline at end of file
+        self.current_view *= 0.05
+        self.current_view += self.current_field
+        image = self._image
+        # float16 can not hold the color, so multiply in at least float32
+        self.xp.multiply(self.current_view, self.color, out=image, casting='unsafe',
+                         dtype=np.promote_types(self.current_view.dtype, np.float32))
+        if self.xp is not np:
+            # pygame can only draw arrays in host memory
+            image = image.get(out=self._host_image)
+        return image
\ No newline at end of file
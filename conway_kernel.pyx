@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# cython: language_level=3
+"""
+Compiled update step for the Conway class. Build it in place with
+
+    python setup.py build_ext --inplace
+
+@author: dkappe
+"""
+cimport cython
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cpdef void update_padded(const unsigned char[:, ::1] pad, unsigned char[:, ::1] new) except *:
+    """
+    Writes the next generation into new. Both fields have a border of dead
+    cells around them, so no bounds have to be checked. Only the inner part
+    of new is written.
+    """
+    cdef Py_ssize_t col, row
+    cdef int n
+    if new.shape[0] != pad.shape[0] or new.shape[1] != pad.shape[1]:
+        raise ValueError(f"shape of new {(new.shape[0], new.shape[1])} does not match "
+                         f"shape of pad {(pad.shape[0], pad.shape[1])}")
+    for col in range(1, pad.shape[0] - 1):
+        for row in range(1, pad.shape[1] - 1):
+            n = (pad[col-1, row-1] + pad[col-1, row] + pad[col-1, row+1]
+                 + pad[col, row-1] + pad[col, row+1]
+                 + pad[col+1, row-1] + pad[col+1, row] + pad[col+1, row+1])
+            # born with 3, survive with 2 or 3 neighbors
+            new[col, row] = (n == 3) | ((n == 2) & (pad[col, row] != 0))
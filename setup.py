@@ -0,0 +1,15 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Builds the optional Cython kernel used by Conway.update_field_cython:
+
+    python setup.py build_ext --inplace
+"""
+from setuptools import setup
+from Cython.Build import cythonize
+
+
+setup(
+    name="conway",
+    ext_modules=cythonize("conway_kernel.pyx"),
+)